@@ -0,0 +1,34 @@
+"""
+Module containing the API response cache settings.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+
+# Number of seconds API responses are cached for. Data only changes when
+# it is imported, so responses can be cached for long periods
+CACHE_TIMEOUT = getattr(settings, "DJANGO_POSTAL_CODES_CACHE_TIMEOUT", 60 * 60)
+
+# Cache (alias of `CACHES`) where API responses are stored. A dedicated cache
+# lets imports clear the responses without touching anything else
+CACHE_ALIAS = getattr(settings, "DJANGO_POSTAL_CODES_CACHE", DEFAULT_CACHE_ALIAS)
+
+CACHE_KEY_PREFIX = "django_postal_codes"
+
+
+def clear_cache() -> None:
+    """
+    Clears the cached API responses, so imported data is served right away.
+    The default cache is never cleared, as it holds the project's other
+    cached data too.
+    """
+    if CACHE_ALIAS == DEFAULT_CACHE_ALIAS:
+        logging.warning(
+            "API responses are cached in the default cache, which is not cleared "
+            "after imports. Set DJANGO_POSTAL_CODES_CACHE to a dedicated cache to "
+            "clear them automatically."
+        )
+        return
+
+    caches[CACHE_ALIAS].clear()
@@ -88,7 +88,7 @@ class LocalityFilter(filters.FilterSet):
 
     # Allow filtering on country name
     country_name = filters.CharFilter(
-        field_name="county__district__country__name",
+        field_name="country__name",
         lookup_expr="icontains",
         help_text=COUNTRY_HELP_TEXT,
     )
@@ -125,7 +125,7 @@ class PostalCodeFilter(filters.FilterSet):
 
     # Allow filtering on country name
     country_name = filters.CharFilter(
-        field_name="locality__county__district__country__name",
+        field_name="country__name",
         lookup_expr="icontains",
         help_text=COUNTRY_HELP_TEXT,
     )
@@ -166,4 +166,11 @@ class PostalCodeFilter(filters.FilterSet):
 
     class Meta:
         model = PostalCode
-        fields = "__all__"
+        fields = [
+            "country_name",
+            "district_name",
+            "county_name",
+            "locality_name",
+            "postal_code",
+            "postal_code_extension",
+        ]
@@ -0,0 +1,14 @@
+"""
+Module containing API pagination classes.
+"""
+from rest_framework.pagination import LimitOffsetPagination
+
+
+class BoundedLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination with a capped page size, so list endpoints
+    never load an unbounded number of rows in memory.
+    """
+
+    default_limit = 100
+    max_limit = 1000
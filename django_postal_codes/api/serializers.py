@@ -1,19 +1,81 @@
 """
 Module containing API serializers.
 """
-from django.contrib.gis.geos import MultiPolygon
+import shapely
+from django.contrib.gis.geos import GEOSGeometry
 from rest_framework import serializers
+from rest_framework.request import Request
 from django_postal_codes.models import (
     Country,
     District,
     County,
     Locality,
     PostalCode,
-    compute_polygon_union,
 )
 
 
-class CountrySerializer(serializers.HyperlinkedModelSerializer):
+def is_field_requested(request: Request, field_name: str) -> bool:
+    """
+    Returns whether a field should be rendered, according to the `fields`
+    and `omit` query parameters (comma separated field names) of the request.
+    """
+    fields = request.query_params.get("fields")
+    omit = request.query_params.get("omit")
+
+    if fields and field_name not in fields.split(","):
+        return False
+
+    if omit and field_name in omit.split(","):
+        return False
+
+    return True
+
+
+class DynamicReadSerializerMixin:
+    """
+    Serializer mixin that lets clients pick the rendered fields with the
+    `fields` and `omit` query parameters.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get("request")
+        if request is None:
+            return
+
+        for field_name in list(self.fields):
+            if not is_field_requested(request, field_name):
+                self.fields.pop(field_name)
+
+
+class MultiPolygonField(serializers.Field):
+    """
+    Read-only field that renders a geometry as a GeoJSON
+    multipolygon dictionary.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value: GEOSGeometry) -> dict:
+        """
+        Returns the geometry as a GeoJSON dictionary, making sure
+        it is a MultiPolygon.
+        """
+        # Read the geometry from WKB, instead of exporting it as GeoJSON text
+        # and parsing it back
+        geometry = shapely.from_wkb(bytes(value.wkb))
+        if geometry.geom_type == "Polygon":
+            geometry = shapely.MultiPolygon([geometry])
+
+        return geometry.__geo_interface__
+
+
+class CountrySerializer(
+    DynamicReadSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     """
     Serializer class for a `Country`.
     """
@@ -40,12 +102,15 @@ class DetailCountrySerializer(CountrySerializer):
         fields = ["id", "url", "name", "created_on", "updated_on", "districts"]
 
 
-class DistrictSerializer(serializers.HyperlinkedModelSerializer):
+class DistrictSerializer(
+    DynamicReadSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     """
     Serializer class for a `District` in List view.
     """
 
     # Include url for parent object (country)
+    # (built from `country_id` alone, the country row is never fetched)
     parent_url = serializers.HyperlinkedRelatedField(
         source="country",
         read_only=True,
@@ -72,18 +137,9 @@ class DetailDistrictSerializer(DistrictSerializer):
         view_name="county-detail",
     )
 
-    # Compute polygon of district by merging polygons of all localities
-    # of all counties
-    polygon = serializers.SerializerMethodField(read_only=True)
-
-    def get_polygon(self, obj: County) -> MultiPolygon:
-        """
-        Computes the polygon of `County` from the union of all
-        child `Locality` polygons.
-        """
-        polygons = list(obj.counties.values_list("localities__polygon", flat=True))
-
-        return compute_polygon_union(polygons)
+    # Polygon of district, stored on import as the union of the polygons
+    # of all localities of all counties
+    polygon = MultiPolygonField()
 
     class Meta:
         model = District
@@ -100,12 +156,15 @@ class DetailDistrictSerializer(DistrictSerializer):
         ]
 
 
-class CountySerializer(serializers.HyperlinkedModelSerializer):
+class CountySerializer(
+    DynamicReadSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     """
     Serializer class for a `County` in List view.
     """
 
     # Include url for parent object (district)
+    # (built from `district_id` alone, the district row is never fetched)
     parent_url = serializers.HyperlinkedRelatedField(
         source="district",
         read_only=True,
@@ -133,17 +192,9 @@ class DetailCountySerializer(CountySerializer):
         view_name="locality-detail",
     )
 
-    # Compute polygon of county by merging all localities polygons
-    polygon = serializers.SerializerMethodField(read_only=True)
-
-    def get_polygon(self, obj: County) -> MultiPolygon:
-        """
-        Computes the polygon of `County` from the union of all
-        child `Locality` polygons.
-        """
-        polygons = list(obj.localities.values_list("polygon", flat=True))
-
-        return compute_polygon_union(polygons)
+    # Polygon of county, stored on import as the union of the polygons
+    # of all localities
+    polygon = MultiPolygonField()
 
     class Meta:
         model = County
@@ -161,12 +212,15 @@ class DetailCountySerializer(CountySerializer):
         ]
 
 
-class LocalitySerializer(serializers.HyperlinkedModelSerializer):
+class LocalitySerializer(
+    DynamicReadSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     """
     Serializer class for a `Locality`.
     """
 
     # Include url for parent object (county)
+    # (built from `county_id` alone, the county row is never fetched)
     parent_url = serializers.HyperlinkedRelatedField(
         source="county",
         read_only=True,
@@ -211,27 +265,27 @@ class DetailLocalitySerializer(LocalitySerializer):
         ]
 
 
-class PostalCodeSerializer(serializers.HyperlinkedModelSerializer):
+class PostalCodeSerializer(
+    DynamicReadSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     """
     Serializer class for a `PostalCode` in List view.
     """
 
     # Include link for parent object (locality)
+    # (built from `locality_id` alone, the locality row is never fetched)
     parent_url = serializers.HyperlinkedRelatedField(
         source="locality",
         read_only=True,
         view_name="locality-detail",
     )
 
-    full_postal_code = serializers.SerializerMethodField(read_only=True)
+    # Full address is stored when the postal code is saved, so it is
+    # read straight from its column with no per-row work
+    full_address = serializers.CharField(read_only=True)
 
-    def get_full_postal_code(self, obj: PostalCode) -> str:
-        """
-        Returns the full postal code in a string version
-        """
-        return (
-            f"{str(obj.postal_code).zfill(4)}-{str(obj.postal_code_extension).zfill(3)}"
-        )
+    # Full postal code string, annotated by the viewset
+    full_postal_code = serializers.CharField(read_only=True)
 
     class Meta:
         model = PostalCode
@@ -252,22 +306,38 @@ class DetailPostalCodeSerializer(PostalCodeSerializer):
     county = serializers.ReadOnlyField(source="locality.county.name")
     locality = serializers.ReadOnlyField(source="locality.name")
 
-    # Custom fields
-    postal_code = serializers.SerializerMethodField()
-    postal_code_extension = serializers.SerializerMethodField()
-
-    def get_postal_code(self, obj) -> str:
-        """
-        Returns the postal code as fixed 4 digits string
-        """
-        return str(obj.postal_code).zfill(4)
-
-    def get_postal_code_extension(self, obj) -> str:
-        """
-        Returns the postal code extension as fixed 3 digits string
-        """
-        return str(obj.postal_code_extension).zfill(3)
+    # Postal code as fixed 4 digits string and extension as fixed 3 digits
+    # string, annotated by the viewset
+    postal_code = serializers.CharField(
+        source="formatted_postal_code",
+        read_only=True,
+    )
+    postal_code_extension = serializers.CharField(
+        source="formatted_postal_code_extension",
+        read_only=True,
+    )
 
     class Meta:
         model = PostalCode
-        fields = "__all__"
+        fields = [
+            "id",
+            "url",
+            "parent_url",
+            "country",
+            "district",
+            "county",
+            "locality",
+            "artery_type",
+            "prep1",
+            "artery_title",
+            "prep2",
+            "artery_name",
+            "artery_local",
+            "postal_code",
+            "postal_code_extension",
+            "full_postal_code",
+            "postal_designation",
+            "full_address",
+            "created_on",
+            "updated_on",
+        ]
@@ -1,13 +1,22 @@
 """
 Module containing the app API views.
 """
+import json
+
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import cache_page
 from django.utils.translation import gettext_lazy as _
 from rest_framework import mixins, viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.request import Request
 from django_filters import rest_framework as filters
-from django.contrib.gis.db.models.aggregates import Union
+from django.db.models import Case, CharField, F, Prefetch, QuerySet, Value, When
+from django.db.models.functions import Cast, Concat, Length, LPad
+from django.db.models.lookups import LessThan
 
 from django_postal_codes.models import Country, District, County, Locality, PostalCode
-from django_postal_codes.api.serializers import PostalCodeSerializer
 
 from .serializers import (
     # Country serializers
@@ -25,7 +34,11 @@ from .serializers import (
     # Postal code serializers
     PostalCodeSerializer,
     DetailPostalCodeSerializer,
+    # Helpers
+    is_field_requested,
 )
+from .cache import CACHE_ALIAS, CACHE_KEY_PREFIX, CACHE_TIMEOUT
+from .pagination import BoundedLimitOffsetPagination
 from .filters import (
     CountryFilter,
     DistrictFilter,
@@ -35,11 +48,56 @@ from .filters import (
 )
 
 
+def zero_fill(field_name: str, width: int) -> Case:
+    """
+    Formats an integer field as a string left padded with zeros up to `width`,
+    like `str.zfill`. Longer values are kept whole instead of truncated.
+    """
+    text = Cast(field_name, CharField())
+    return Case(
+        When(LessThan(Length(text), width), then=LPad(text, width, Value("0"))),
+        default=text,
+        output_field=CharField(),
+    )
+
+
+def annotate_postal_codes(queryset: QuerySet) -> QuerySet:
+    """
+    Annotates a `PostalCode` queryset with the postal code, extension and
+    full postal code formatted as fixed width strings by the database.
+    """
+    return queryset.annotate(
+        formatted_postal_code=zero_fill("postal_code", 4),
+        formatted_postal_code_extension=zero_fill("postal_code_extension", 3),
+    ).annotate(
+        full_postal_code=Concat(
+            "formatted_postal_code",
+            Value("-"),
+            "formatted_postal_code_extension",
+            output_field=CharField(),
+        ),
+    )
+
+
 class BaseViewSet(
     viewsets.GenericViewSet,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
 ):
+    pagination_class = BoundedLimitOffsetPagination
+
+    @method_decorator(
+        cache_page(CACHE_TIMEOUT, cache=CACHE_ALIAS, key_prefix=CACHE_KEY_PREFIX)
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(
+        cache_page(CACHE_TIMEOUT, cache=CACHE_ALIAS, key_prefix=CACHE_KEY_PREFIX)
+    )
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def get_serializer_class(self):
 
         if hasattr(self, "action_serializers"):
@@ -47,6 +105,28 @@ class BaseViewSet(
 
         return super().get_serializer_class()
 
+    def get_queryset(self):
+
+        if hasattr(self, "action_querysets"):
+            queryset = self.action_querysets.get(self.action, self.queryset).all()
+        else:
+            queryset = super().get_queryset()
+
+        # Schema generation and other introspection run without a request
+        if getattr(self, "request", None) is None:
+            return queryset
+
+        # Don't load expensive columns the client didn't ask for
+        deferred_fields = [
+            field_name
+            for field_name in getattr(self, "deferrable_fields", [])
+            if not is_field_requested(self.request, field_name)
+        ]
+        if deferred_fields:
+            queryset = queryset.defer(*deferred_fields)
+
+        return queryset
+
 
 class CountryViewset(BaseViewSet):
     """
@@ -70,8 +150,8 @@ class DistrictViewset(BaseViewSet):
     API endpoint to retrieve districts.
     """
 
-    # Select upstream foreign keys and prefetch downstream related
-    queryset = District.objects.select_related("country").prefetch_related("counties")
+    # Select upstream foreign keys
+    queryset = District.objects.select_related("country")
 
     serializer_class = DistrictSerializer
     permission_classes = [permissions.AllowAny]
@@ -83,16 +163,26 @@ class DistrictViewset(BaseViewSet):
         "list": DistrictSerializer,
     }
 
+    action_querysets = {
+        # Prefetch downstream counties (only their urls are shown)
+        "retrieve": queryset.prefetch_related(
+            Prefetch("counties", queryset=County.objects.only("id", "district"))
+        ),
+        # List view only shows the name and the parent url
+        "list": District.objects.only("id", "name", "country"),
+    }
+
+    # Columns only loaded when requested
+    deferrable_fields = ["polygon"]
+
 
 class CountyViewset(BaseViewSet):
     """
     API endpoint to retrieve counties.
     """
 
-    # Select upstream foreign keys and prefetch downstream related
-    queryset = County.objects.select_related("district__country").prefetch_related(
-        "localities"
-    )
+    # Select upstream foreign keys
+    queryset = County.objects.select_related("district__country")
 
     serializer_class = CountySerializer
     permission_classes = [permissions.AllowAny]
@@ -104,6 +194,18 @@ class CountyViewset(BaseViewSet):
         "list": CountySerializer,
     }
 
+    action_querysets = {
+        # Prefetch downstream localities (only their urls are shown)
+        "retrieve": queryset.prefetch_related(
+            Prefetch("localities", queryset=Locality.objects.only("id", "county"))
+        ),
+        # List view only shows the name and the parent url
+        "list": County.objects.only("id", "name", "district"),
+    }
+
+    # Columns only loaded when requested
+    deferrable_fields = ["polygon"]
+
 
 class LocalityViewset(BaseViewSet):
     """
@@ -122,13 +224,28 @@ class LocalityViewset(BaseViewSet):
         "list": LocalitySerializer,
     }
 
+    action_querysets = {
+        # List view only shows the name and the parent url, so skip the
+        # upstream joins and the polygon column
+        "list": Locality.objects.only("id", "name", "county"),
+    }
+
+    # Columns only loaded when requested
+    deferrable_fields = ["polygon"]
+
 
 class PostalCodesViewSet(BaseViewSet):
     """
     API endpoint to retrieve postal codes.
     """
 
-    queryset = PostalCode.objects.all()
+    # Select upstream foreign keys, without the locality polygon which is
+    # never shown for a postal code
+    queryset = annotate_postal_codes(
+        PostalCode.objects.select_related("locality__county__district__country").defer(
+            "locality__polygon"
+        )
+    )
     serializer_class = PostalCodeSerializer
     permission_classes = [permissions.AllowAny]
     filter_backends = [filters.DjangoFilterBackend]
@@ -138,3 +255,61 @@ class PostalCodesViewSet(BaseViewSet):
         "retrieve": DetailPostalCodeSerializer,
         "list": PostalCodeSerializer,
     }
+
+    # Flat rows (plain dictionaries) used by the bulk endpoints
+    flat_queryset = annotate_postal_codes(PostalCode.objects.all()).values(
+        "id",
+        "locality_id",
+        "full_postal_code",
+        "postal_designation",
+        "full_address",
+        locality_name=F("locality__name"),
+        county_name=F("locality__county__name"),
+        district_name=F("locality__county__district__name"),
+        country_name=F("country__name"),
+    )
+
+    action_querysets = {
+        # List view doesn't show the artery fields
+        "list": annotate_postal_codes(
+            PostalCode.objects.only("id", "locality", "full_address")
+        ),
+        "json_list": flat_queryset,
+        "export": flat_queryset,
+    }
+
+    @action(methods=["get"], detail=False, url_path="json")
+    def json_list(self, request: Request) -> HttpResponse:
+        """
+        Lists postal codes as flat rows, with the JSON document built by
+        PostgreSQL (`row_to_json`/`json_agg`) instead of serializing each
+        row in Python. Supports the same filters and `limit`/`offset`
+        parameters as the list endpoint.
+        """
+        limit = self.paginator.get_limit(request)
+        offset = self.paginator.get_offset(request)
+
+        queryset = self.filter_queryset(self.get_queryset())[offset : offset + limit]
+        sql, params = queryset.query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COALESCE(json_agg(row_to_json(t))::text, '[]') "
+                f"FROM ({sql}) t",
+                params,
+            )
+            content = cursor.fetchone()[0]
+
+        return HttpResponse(content, content_type="application/json")
+
+    @action(methods=["get"], detail=False)
+    def export(self, request: Request) -> StreamingHttpResponse:
+        """
+        Streams all the (filtered) postal codes as newline delimited JSON.
+        Rows are read from a server-side cursor in chunks, so memory usage
+        doesn't depend on the number of postal codes.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = (json.dumps(row) + "\n" for row in queryset.iterator(chunk_size=2000))
+
+        return StreamingHttpResponse(rows, content_type="application/x-ndjson")
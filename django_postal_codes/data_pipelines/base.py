@@ -2,13 +2,40 @@
 Module containing a base strategy to import Data for a specific
 country
 """
-from typing import Optional
+import contextlib
+import functools
+import io
+import itertools
+from typing import Any, Iterable, List, Optional, Tuple, Type
 from abc import ABC, abstractproperty, abstractmethod
-from django.db import transaction
-from django.contrib.gis.geos import Point
+from django.db import connection, models, transaction
 import pgeocode
 import numpy as np
-from django_postal_codes.models import Country, District, County, Locality
+from django_postal_codes.api.cache import clear_cache
+from django_postal_codes.models import (
+    Country,
+    District,
+    County,
+    Locality,
+    update_denormalized_countries,
+    update_region_polygons,
+)
+
+
+def _copy_value(value: Any) -> str:
+    """
+    Formats a value for PostgreSQL's `COPY` text format.
+    """
+    if value is None:
+        return "\\N"
+
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
 
 
 class CountryStrategy(ABC):
@@ -39,31 +66,124 @@ class CountryStrategy(ABC):
         Child classes must implement this property to return the country name.
         """
 
-    @property
+    @functools.cached_property
     def country(self) -> Country:
         """
         Returns the `Country` object based on `country_name`
         """
         return Country.objects.get_or_create(name=self.country_name)[0]
 
-    def coordinates_from_postal_code(
+    def coordinates_from_postal_codes(
         self,
-        postal_code: str,
-        postal_code_extension: str,
-    ) -> Optional[Point]:
+        postal_codes: List[Tuple[str, str]],
+    ) -> np.ndarray:
         """
-        Returns a Django `Point` (coordinates) based on a provided postal code
+        Returns an (n, 2) array with the longitude and latitude of each provided
+        (postal code, postal code extension) pair, with NaNs for unknown ones.
+        All the postal codes are resolved with a single vectorized Nominatim query.
         """
-        full_postal_str = f"{postal_code}-{str(postal_code_extension).zfill(3)}"
+        full_postal_strs = [
+            f"{postal_code}-{str(postal_code_extension).zfill(3)}"
+            for postal_code, postal_code_extension in postal_codes
+        ]
 
-        response = self.nominatim.query_postal_code(full_postal_str)
+        response = self.nominatim.query_postal_code(full_postal_strs)
+        return response[["longitude", "latitude"]].to_numpy(dtype=float)
 
-        latitude = response["latitude"], longitude = response["longitude"]
-
-        if np.isnan(latitude) or np.isnan(longitude):
-            return None
-
-        return Point(longitude, latitude)
+    def _bulk_insert(
+        self,
+        model: Type[models.Model],
+        objects: List[models.Model],
+        batch_size: int = 5000,
+        unique_fields: Optional[List[str]] = None,
+    ) -> None:
+        """
+        Inserts `objects` in the `model` table using multi-row INSERT statements
+        of `batch_size` rows each, instead of one statement per object.
+        If `unique_fields` is provided, rows that already exist with the same
+        values are updated in place instead (upsert).
+        """
+        upsert_options = {}
+        if unique_fields:
+            upsert_options = {
+                "update_conflicts": True,
+                "unique_fields": unique_fields,
+                "update_fields": [
+                    field.name
+                    for field in model._meta.concrete_fields
+                    if not field.primary_key
+                    and field.name not in unique_fields
+                    and field.name != "created_on"
+                ],
+            }
+
+        model.objects.bulk_create(objects, batch_size=batch_size, **upsert_options)
+
+    def _copy_insert(
+        self,
+        model: Type[models.Model],
+        objects: Iterable[models.Model],
+        batch_size: int = 10_000,
+    ) -> None:
+        """
+        Inserts `objects` in the `model` table with PostgreSQL's `COPY FROM STDIN`,
+        streaming `batch_size` rows at a time. Skips the per-row statement and
+        parameter handling of INSERTs, so it is much faster for large volumes.
+        """
+        fields = [
+            field for field in model._meta.concrete_fields if not field.primary_key
+        ]
+        sql = "COPY {table} ({columns}) FROM STDIN".format(
+            table=connection.ops.quote_name(model._meta.db_table),
+            columns=", ".join(connection.ops.quote_name(f.column) for f in fields),
+        )
+
+        objects = iter(objects)
+        with connection.cursor() as cursor:
+            while batch := list(itertools.islice(objects, batch_size)):
+                stream = io.StringIO()
+                for obj in batch:
+                    values = [
+                        field.get_db_prep_save(field.pre_save(obj, True), connection)
+                        for field in fields
+                    ]
+                    stream.write("\t".join(map(_copy_value, values)) + "\n")
+                stream.seek(0)
+
+                # psycopg2 and psycopg 3 expose COPY differently
+                if hasattr(cursor.cursor, "copy_expert"):
+                    cursor.copy_expert(sql, stream)
+                else:
+                    with cursor.copy(sql) as copy:
+                        copy.write(stream.getvalue())
+
+    @contextlib.contextmanager
+    def _without_indexes(self, model: Type[models.Model]):
+        """
+        Drops the indexes of the `model` table while the block runs and rebuilds them
+        once at the end, so bulk loads skip the index maintenance of every row.
+        Indexes backing constraints are kept. `DROP INDEX` locks the table against
+        reads until the transaction commits, so only use it on tables that were
+        empty before the import.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes "
+                "WHERE schemaname = current_schema() AND tablename = %s "
+                "AND NOT EXISTS (SELECT 1 FROM pg_constraint "
+                "WHERE conindid = (quote_ident(schemaname) || '.' || "
+                "quote_ident(indexname))::regclass)",
+                [model._meta.db_table],
+            )
+            indexes = cursor.fetchall()
+            for name, _ in indexes:
+                cursor.execute(f"DROP INDEX {connection.ops.quote_name(name)}")
+
+        yield
+
+        with connection.cursor() as cursor:
+            for _, definition in indexes:
+                cursor.execute(definition)
 
     def execute(self) -> None:
         """
@@ -75,17 +195,20 @@ class CountryStrategy(ABC):
             self.populate_country()
             self.populate_districts()
             self.populate_counties()
+            self.populate_localities()
             self.populate_postal_codes()
+            update_region_polygons()
+            update_denormalized_countries()
+        # Stop serving the responses cached before the import
+        clear_cache()
 
     def populate_country(self) -> None:
         """
-        Populates the `Country` table with a new row based on `.country_name` property.
+        Populates the `Country` table with a row based on `.country_name` property.
         """
-        # Delete existing country
-        # Will cascade the deletion of entire data about this country
-        Country.objects.filter(name=self.country_name).delete()
-        # Create new instance
-        Country.objects.create(name=self.country_name)
+        # Keep the existing country (if any) so its data is updated in place
+        # by the other steps, instead of cascading a delete through every table
+        Country.objects.update_or_create(name=self.country_name, defaults={})
 
     @abstractmethod
     def populate_districts(self) -> None:
@@ -99,6 +222,12 @@ class CountryStrategy(ABC):
         Child classes must implement this method to populate the `County` table.
         """
 
+    @abstractmethod
+    def populate_localities(self) -> None:
+        """
+        Child classes must implement this method to populate the `Locality` table.
+        """
+
     @abstractmethod
     def populate_postal_codes(self) -> None:
         """
@@ -1,50 +1,157 @@
 """
 Loads data from Portugal into the database
 """
+import collections
+import contextlib
+import functools
 import logging
+import os
+import shutil
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
 import tqdm
-from django.contrib.gis.geos import GEOSGeometry, fromstr
-import ast
+from django.contrib.gis.geos import GEOSGeometry
 import glob
 import pandas as pd
+import pyarrow.csv
 import numpy as np
-from joblib import Parallel, delayed
+import shapely
 from shapely.ops import unary_union
-from shapely.geometry import shape
 from django.contrib.gis.geos import MultiPolygon
 from tqdm import tqdm
-from django.contrib.gis.gdal import DataSource
-from django_postal_codes.models import District, PostalCode, County, Locality
+from django.contrib.gis.db.models.functions import AsWKB
+from django.contrib.gis.gdal import CoordTransform, DataSource, SpatialReference
+from django_postal_codes.models import (
+    District,
+    PostalCode,
+    County,
+    Locality,
+    format_full_address,
+)
 from django_postal_codes import BASE_DIR
 from ..base import CountryStrategy
 
+CAOP_PATH = f"{BASE_DIR}/data_pipelines/portugal/caop2021.xls"
+# Parquet copy of the CAOP sheet, which is much faster to read than the XLS
+CAOP_CACHE_PATH = f"{BASE_DIR}/data_pipelines/portugal/caop2021.parquet"
+POSTAL_CODES_URL = "https://raw.githubusercontent.com/centraldedados/codigos_postais/master/data/codigos_postais.csv"
+# Local copy of the postal codes CSV, to avoid downloading it on every run
+POSTAL_CODES_CACHE_PATH = f"{BASE_DIR}/data_pipelines/portugal/codigos_postais.csv"
+
+
+def chunked_unary_union(polygons: list, chunk_size: int = 50):
+    """
+    Computes the union of shapely polygons in a single cascaded pass.
+    Large lists are first merged in chunks of `chunk_size` and the partial
+    results merged afterwards, which is considerably faster for many small
+    adjacent polygons.
+    """
+    if len(polygons) > chunk_size:
+        polygons = [
+            unary_union(polygons[i : i + chunk_size])
+            for i in range(0, len(polygons), chunk_size)
+        ]
+
+    return unary_union(polygons)
+
 
 class PortugalStrategy(CountryStrategy):
     """
     Defines a data import strategy for country "Portugal"
     """
 
-    def __init__(self) -> None:
+    # Data sources are only read when a step first needs them, so building the
+    # strategy (or running only some steps) doesn't load all of them
+
+    @functools.cached_property
+    def caop_sheet(self) -> pd.DataFrame:
         """
-        Class constructor
+        CAOP sheet with the administrative regions of Portugal
         """
-        super().__init__()
-        # Read caop file
-        self.caop_sheet = pd.read_excel(
-            f"{BASE_DIR}/data_pipelines/portugal/caop2021.xls",
-            sheet_name="Areas_Freguesias_CAOP2021",
-        )
-        # Load administrative regions from CAOP files
-        self.features = [
-            feature
-            for file in glob.glob(f"{BASE_DIR}/data_pipelines/portugal/*.gpkg")
-            for feature in DataSource(file)[0]
-        ]
-        # Load postal codes data
-        self.postal_codes_sheet = pd.read_csv(
-            "https://raw.githubusercontent.com/centraldedados/codigos_postais/master/data/codigos_postais.csv"
-        )
-        self.postal_codes_sheet.replace({np.nan: None}, inplace=True)
+        # Parsing the XLS is slow, so it is converted to Parquet on the first run
+        # and the Parquet copy is read afterwards
+        is_cached = os.path.exists(CAOP_CACHE_PATH) and os.path.getmtime(
+            CAOP_CACHE_PATH
+        ) >= os.path.getmtime(CAOP_PATH)
+        if not is_cached:
+            caop_sheet = pd.read_excel(
+                CAOP_PATH, sheet_name="Areas_Freguesias_CAOP2021"
+            )
+            # Dicofres are read both as numbers and as strings, which Parquet
+            # columns can't mix
+            caop_sheet["DICOFRE"] = caop_sheet["DICOFRE"].map(
+                lambda dicofre: dicofre if pd.isna(dicofre) else str(dicofre)
+            )
+            caop_sheet.to_parquet(CAOP_CACHE_PATH)
+
+        return pd.read_parquet(CAOP_CACHE_PATH)
+
+    @functools.cached_property
+    def geometries_by_dicofre(self) -> Dict[str, List[bytes]]:
+        """
+        Geometries (as WKB, in normal lat/lon system) of the administrative
+        regions from CAOP files, grouped by dicofre
+        """
+        # Group them once, instead of scanning every feature for each locality
+        geometries_by_dicofre = collections.defaultdict(list)
+        for file in glob.glob(f"{BASE_DIR}/data_pipelines/portugal/*.gpkg"):
+            layer = DataSource(file)[0]
+            # Reuse a single transformation for the whole layer, instead of
+            # building one for every geometry
+            transform = CoordTransform(layer.srs, SpatialReference(4326))
+            for feature in layer:
+                geometry = feature.geom
+                geometry.transform(transform)
+                geometries_by_dicofre[feature.get("Dicofre")].append(
+                    bytes(geometry.wkb)
+                )
+        return geometries_by_dicofre
+
+    @functools.cached_property
+    def postal_codes_sheet(self) -> pd.DataFrame:
+        """
+        Postal codes data
+        """
+        # Arrow keeps missing values of text columns as None when converted to
+        # pandas, so there is no need for a second pass replacing NaNs
+        return pyarrow.csv.read_csv(
+            self.download_postal_codes(),
+            convert_options=pyarrow.csv.ConvertOptions(strings_can_be_null=True),
+        ).to_pandas()
+
+    def download_postal_codes(self) -> str:
+        """
+        Downloads the postal codes CSV into a local cache, and returns its path.
+        The cached file is only downloaded again when its ETag changes.
+        """
+        etag_path = f"{POSTAL_CODES_CACHE_PATH}.etag"
+
+        request = urllib.request.Request(POSTAL_CODES_URL)
+        if os.path.exists(POSTAL_CODES_CACHE_PATH) and os.path.exists(etag_path):
+            with open(etag_path) as file:
+                request.add_header("If-None-Match", file.read())
+
+        try:
+            with urllib.request.urlopen(request) as response:
+                # Replace the cached file only once fully downloaded
+                with open(f"{POSTAL_CODES_CACHE_PATH}.part", "wb") as file:
+                    shutil.copyfileobj(response, file)
+                os.replace(f"{POSTAL_CODES_CACHE_PATH}.part", POSTAL_CODES_CACHE_PATH)
+                etag = response.headers.get("ETag")
+        except urllib.error.HTTPError as error:
+            # Not modified, keep using the cached file
+            if error.code != 304:
+                raise
+            return POSTAL_CODES_CACHE_PATH
+
+        if etag:
+            with open(etag_path, "w") as file:
+                file.write(etag)
+        elif os.path.exists(etag_path):
+            os.remove(etag_path)
+
+        return POSTAL_CODES_CACHE_PATH
 
     @property
     def country_name(self) -> str:
@@ -58,25 +165,32 @@ class PortugalStrategy(CountryStrategy):
         """
         Populates the `District` table for Portugal.
         """
+        country = self.country
         # Create districts
         districts = [
             District(
                 name=district_name,
-                country=self.country,
+                country=country,
             )
             for district_name in self.caop_sheet["DISTRITO_ILHA_DSG"].dropna().unique()
         ]
-        District.objects.all().delete()
-        # Create in bulk for performance
-        District.objects.bulk_create(districts)
+        # Upsert in bulk for performance
+        self._bulk_insert(District, districts, unique_fields=["country", "name"])
 
     def populate_counties(self) -> None:
         """
         Populates the `County` table for Portugal.
         """
+        # Map district names to ids once, instead of fetching a district per county
+        district_ids = {
+            name: pk
+            for pk, name in District.objects.filter(country=self.country).values_list(
+                "id", "name"
+            )
+        }
         # Create counties
         counties = [
-            County(name=county_name, district=District.objects.get(name=district_name))
+            County(name=county_name, district_id=district_ids[district_name])
             for district_name, county_name in self.caop_sheet[
                 ["DISTRITO_ILHA_DSG", "CONCELHO_DSG"]
             ]
@@ -84,20 +198,26 @@ class PortugalStrategy(CountryStrategy):
             .dropna()
             .values
         ]
-        County.objects.bulk_create(counties)
+        self._bulk_insert(County, counties, unique_fields=["district", "name"])
 
     def populate_localities(self) -> None:
         """
         Populates the `Locality` table for Portugal.
         """
+        # Map (district, county) names to ids once, instead of fetching a county per
+        # locality
+        county_ids = {
+            (district_name, county_name): pk
+            for pk, district_name, county_name in County.objects.filter(
+                district__country=self.country
+            ).values_list("id", "district__name", "name")
+        }
         # Create localities objects
         localities = [
             Locality(
                 name=locality_name,
-                county=County.objects.get(
-                    name=county_name,
-                    district__name=district_name,
-                ),
+                county_id=county_ids[(district_name, county_name)],
+                country=self.country,
                 polygon=self.find_poly(dicofre=dicofre),
             )
             for district_name, locality_name, county_name, dicofre in self.caop_sheet[
@@ -107,94 +227,202 @@ class PortugalStrategy(CountryStrategy):
             .dropna()
             .values
         ]
-        Locality.objects.bulk_create(localities)
+        # Polygons are large, so keep the batches small. Bulk inserts skip
+        # `Locality.save()`, but `find_poly` already returns MultiPolygons
+        self._bulk_insert(
+            Locality, localities, batch_size=500, unique_fields=["county", "name"]
+        )
 
-    def create_postal_codes(self) -> None:
+    def populate_postal_codes(self) -> None:
         """
         Populates the `PostalCode` with portuguese data.
         """
 
-        iterator = reversed(list(self.postal_codes_sheet.itertuples()))
+        # Without previous postal codes there are no readers to block, so the
+        # indexes can be dropped during the load and rebuilt once at the end
+        first_import = not PostalCode.objects.exists()
 
-        queryset = PostalCode.objects.all()
+        # Postal codes have no natural key, so the country's ones are replaced
+        queryset = PostalCode.objects.filter(
+            locality__county__district__country__name=self.country_name
+        )
         queryset._raw_delete(queryset.db)
 
-        # Create parallel jobs using threads since the postal codes has a really high volume
-        _ = Parallel(n_jobs=-1, prefer="threads", require="sharedmem")(
-            delayed(self.process_postal_code_row)(row)
-            for row in tqdm(iterator, total=self.postal_codes_sheet.shape[0])
+        # Resolve the coordinates of every postal code in a single batch
+        postal_codes = list(
+            set(
+                zip(
+                    self.postal_codes_sheet["num_cod_postal"],
+                    self.postal_codes_sheet["ext_cod_postal"],
+                )
+            )
         )
+        coordinates = self.coordinates_from_postal_codes(postal_codes)
 
-    def process_postal_code_row(self, row) -> None:
-        """
-        Processes a single row of a postal code and saves it in the `PostalCode` table.
-        """
-        # Find different postal codes with same designation,
-        # same county, same district
+        # Index every locality polygon in memory so points are matched in-process
+        # instead of issuing one spatial query per postal code
+        # The polygons are fetched as raw WKB and decoded by shapely in one call,
+        # without building an intermediate GEOS geometry for each locality
+        localities = (
+            Locality.objects.filter(country=self.country, polygon__isnull=False)
+            .annotate(polygon_wkb=AsWKB("polygon"))
+            .values_list(
+                "id",
+                "name",
+                "county__name",
+                "county__district__name",
+                "county__district__country__name",
+                "polygon_wkb",
+            )
+        )
+        locality_ids = []
+        polygons = []
+        # Keep the region names of every locality to build the full addresses
+        self.locality_names = {}
+        for pk, *names, polygon_wkb in localities:
+            locality_ids.append(pk)
+            polygons.append(bytes(polygon_wkb))
+            self.locality_names[pk] = names
+        polygons = shapely.from_wkb(polygons)
+        shapely.prepare(polygons)
+        tree = shapely.STRtree(polygons)
 
-        cols = [
-            "num_cod_postal",
-            "ext_cod_postal",
-        ]
-        options = self.postal_codes_sheet[
-            (self.postal_codes_sheet["desig_postal"] == row.desig_postal)
-            & (self.postal_codes_sheet["cod_distrito"] == row.cod_distrito)
-            & (self.postal_codes_sheet["cod_concelho"] == row.cod_concelho)
-        ][cols].values.tolist()
+        # Match all the points against the localities in a single vectorized query.
+        # The tree only compares bounding boxes, which discards most localities
+        # cheaply. Unknown coordinates become empty points, which match nothing
+        point_indices, polygon_indices = tree.query(shapely.points(coordinates))
+        # Then test the remaining candidates against the prepared polygons. Querying
+        # the tree with a predicate would prepare the points instead
+        intersects = shapely.intersects_xy(
+            polygons[polygon_indices],
+            coordinates[point_indices, 0],
+            coordinates[point_indices, 1],
+        )
+        point_indices = point_indices[intersects]
+        polygon_indices = polygon_indices[intersects]
+        # A point on a shared boundary intersects several localities, keep the first
+        point_indices, first_matches = np.unique(point_indices, return_index=True)
+        self.postal_code_localities = {
+            postal_codes[point_index]: locality_ids[polygon_index]
+            for point_index, polygon_index in zip(
+                point_indices, polygon_indices[first_matches]
+            )
+        }
 
+        # Group the postal codes with same designation, same county and same district
+        # once, instead of scanning the whole sheet for every row.
         # Options can have non-unique postalcode + extensions
         # To avoid wasting time on repeated combinations we make a set
         # to get unique pairs
+        self.postal_code_options = {
+            key: set(zip(group["num_cod_postal"], group["ext_cod_postal"]))
+            for key, group in self.postal_codes_sheet.groupby(
+                ["desig_postal", "cod_distrito", "cod_concelho"]
+            )
+        }
+
+        # Read rows by index from plain column arrays, which avoids building a
+        # pandas row object for every postal code
+        self.postal_code_columns = {
+            column: self.postal_codes_sheet[column].to_numpy()
+            for column in [
+                "num_cod_postal",
+                "ext_cod_postal",
+                "desig_postal",
+                "cod_distrito",
+                "cod_concelho",
+                "tipo_arteria",
+                "prep1",
+                "titulo_arteria",
+                "prep2",
+                "nome_arteria",
+                "local_arteria",
+                "nome_localidade",
+            ]
+        }
+        rows = range(self.postal_codes_sheet.shape[0] - 1, -1, -1)
+
+        # Resolving a row is now only a few lookups, which is faster in a plain loop
+        # than with the overhead of thread or process pools
+        resolved = (self.process_postal_code_row(index) for index in tqdm(rows))
+
+        # Stream all resolved postal codes to the database
+        indexes = (
+            self._without_indexes(PostalCode)
+            if first_import
+            else contextlib.nullcontext()
+        )
+        with indexes:
+            self._copy_insert(
+                PostalCode,
+                (postal_code for postal_code in resolved if postal_code is not None),
+            )
+
+    def process_postal_code_row(self, index: int) -> Optional[PostalCode]:
+        """
+        Processes the postal code at row `index` and returns the (unsaved) `PostalCode`,
+        or None if its locality could not be found.
+        """
+        columns = self.postal_code_columns
+        postal_code = columns["num_cod_postal"][index]
+        postal_code_extension = columns["ext_cod_postal"][index]
+        postal_designation = columns["desig_postal"][index]
+
+        # Find different postal codes with same designation,
+        # same county, same district
+        options = self.postal_code_options.get(
+            (
+                postal_designation,
+                columns["cod_distrito"][index],
+                columns["cod_concelho"][index],
+            ),
+            set(),
+        )
         options = list(
             sorted(
-                [
-                    el
-                    for el in set(tuple(row) for row in options)
-                    if list(el) != [row.num_cod_postal, row.ext_cod_postal]
-                ],
-                key=lambda tuple: abs(row.ext_cod_postal - tuple[1]),
+                [el for el in options if el != (postal_code, postal_code_extension)],
+                key=lambda tuple: abs(postal_code_extension - tuple[1]),
             )
         )
 
-        locality = None
-        for postal_code, postal_extension in [
-            (row.num_cod_postal, row.ext_cod_postal),
-        ] + options:
-            point = self.coordinates_from_postal_code(postal_code, postal_extension)
-            if not point:
-                continue
-            try:
-                # Get locality which polygon contains the point
-                locality = Locality.objects.get(polygon__intersects=point)
+        # Points outside the country boarders (for instance, at a beach. CAOP
+        # boundaries exclude beaches) have no locality, so try the nearby options
+        locality_id = None
+        for option in [(postal_code, postal_code_extension)] + options:
+            locality_id = self.postal_code_localities.get(option)
+            if locality_id is not None:
                 break
-            # Catch cases where the point is outside the country boarders (for instance,
-            # at a beach. CAOP boundaries exclude beaches)
-            except Locality.DoesNotExist:
-                continue
 
-        if not locality:
+        if locality_id is None:
             logging.warning(
-                "No found locality for ",
-                row.nome_localidade,
-                " Point is: ",
-                point,
-                " row: ",
-                str(row),
+                "No found locality for %s. Postal code is: %s-%s",
+                columns["nome_localidade"][index],
+                postal_code,
+                postal_code_extension,
             )
-            return
-
-        # Save the postal code to database
-        PostalCode.objects.create(
-            locality=locality,
-            artery_type=row.tipo_arteria,
-            prep1=row.prep1,
-            artery_title=row.titulo_arteria,
-            prep2=row.prep2,
-            artery_name=row.nome_arteria,
-            artery_local=row.local_arteria,
-            postal_code=row.num_cod_postal,
-            postal_code_extension=row.ext_cod_postal,
-            postal_designation=row.desig_postal,
+            return None
+
+        artery = {
+            "artery_type": columns["tipo_arteria"][index],
+            "prep1": columns["prep1"][index],
+            "artery_title": columns["titulo_arteria"][index],
+            "prep2": columns["prep2"][index],
+            "artery_name": columns["nome_arteria"][index],
+            "artery_local": columns["local_arteria"][index],
+        }
+
+        # Bulk inserts don't call `save()`, so build the full address here, from the
+        # already loaded region names instead of walking the locality relations
+        return PostalCode(
+            locality_id=locality_id,
+            country=self.country,
+            postal_code=postal_code,
+            postal_code_extension=postal_code_extension,
+            postal_designation=postal_designation,
+            full_address=format_full_address(
+                list(artery.values()), *self.locality_names[locality_id]
+            ),
+            **artery,
         )
 
     def find_poly(
@@ -204,28 +432,23 @@ class PortugalStrategy(CountryStrategy):
         """
         Returns a multipolygon of a portuguese region by "Dicofre" (value from CAOP database)
         """
-        geometries = [
-            feature.geom
-            for feature in self.features
-            if feature.get("Dicofre") == str(dicofre)
-        ]
+        geometries = self.geometries_by_dicofre.get(str(dicofre))
 
         if not geometries:
             raise RuntimeError(
                 f"[{self.country_name.upper()}] Could not find geometries with dicofre {str(dicofre)}"
             )
 
-        # Transform to normal lat/lon system
-        for g in geometries:
-            g.transform(4326)
+        # WKB is decoded much faster than parsing each geometry's GeoJSON
+        polygons = shapely.from_wkb(geometries)
+        merged = chunked_unary_union(polygons)
 
-        polygons = [shape(ast.literal_eval(g.json)) for g in geometries]
-        poly = GEOSGeometry(unary_union(polygons).wkt, srid=4326)
+        # Make sure it is MultiPolygon
+        if merged.geom_type == "Polygon":
+            merged = shapely.MultiPolygon([merged])
 
-        if poly.geom_type != "MultiPolygon":
-            poly = MultiPolygon(
-                fromstr(str(poly)),
-            )
+        # Hand the result over to GEOS as WKB rather than WKT text
+        poly = GEOSGeometry(memoryview(shapely.to_wkb(merged)), srid=4326)
 
         assert poly.geom_type == "MultiPolygon", poly.geom_type
 
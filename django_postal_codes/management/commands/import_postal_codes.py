@@ -1,17 +1,25 @@
 """
 Custom Django command to import data from a GitHub repository
-into the local database
+into the local database.
+
+On the first import, when there are no postal codes yet, the data pipelines
+drop the postal code indexes while loading and rebuild them once at the end.
 """
 import os
 import runpy
 from django_postal_codes import BASE_DIR
+from django_postal_codes.api.cache import clear_cache
+from django_postal_codes.models import (
+    update_denormalized_countries,
+    update_region_polygons,
+)
 from pathlib import Path
 from django.db import transaction
 from django.core.management import call_command
 from django.conf import settings
 from django.core.management.base import BaseCommand
 import glob
-import subprocess
+import shutil
 
 # Check if the user configured which countries' data should be imported
 COUNTRIES_TO_IMPORT = getattr(settings, "DJANGO_POSTAL_CODES_COUNTRIES", None)
@@ -30,17 +38,24 @@ def load_country_fixture(fixture_folder: str) -> None:
 
     if os.path.exists(final_fixture_path):
         os.remove(final_fixture_path)
-    with open(final_fixture_path, "w") as file:
-        # Call is needed to block execution until the script ends
-        # Otherwise, Django will start reading from the file, and it is not
-        # fully merged yet, resulting in an error
-        subprocess.call(f"cat {fixture_folder}/*.json", stdout=file, shell=True)
+    # List the parts before creating the merged file, which lives in the same folder
+    part_paths = sorted(glob.glob(f"{fixture_folder}/*.json"))
+    with open(final_fixture_path, "wb") as file:
+        # Concatenate the parts in Python instead of spawning a shell `cat`
+        for part_path in part_paths:
+            with open(part_path, "rb") as part:
+                shutil.copyfileobj(part, file)
 
     # Now time to load into Django
     # Use a single transaction to speed up loading
     # https://stackoverflow.com/questions/19306807/django-fixture-loading-very-slow
     with transaction.atomic():
         call_command("loaddata", final_fixture_path)
+        # Fixtures only have the localities polygons and no denormalized fields
+        update_region_polygons()
+        update_denormalized_countries()
+    # Stop serving the responses cached before the import
+    clear_cache()
 
 
 class Command(BaseCommand):
@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-15 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_postal_codes", "0004_trigram_name_indexes"),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name="district",
+            constraint=models.UniqueConstraint(
+                fields=("country", "name"), name="unique_district_name_per_country"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="county",
+            constraint=models.UniqueConstraint(
+                fields=("district", "name"), name="unique_county_name_per_district"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="locality",
+            constraint=models.UniqueConstraint(
+                fields=("county", "name"), name="unique_locality_name_per_county"
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-15 09:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_postal_codes", "0005_natural_key_constraints"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="postalcode",
+            name="postal_code",
+            field=models.IntegerField(
+                blank=True, help_text="cp4", verbose_name="Postal Code"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="postalcode",
+            index=models.Index(
+                fields=["postal_code", "postal_code_extension"],
+                name="postal_code_full_idx",
+            ),
+        ),
+    ]
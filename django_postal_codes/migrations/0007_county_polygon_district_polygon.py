@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2026-10-15 10:05
+
+from django.contrib.gis.db.models.aggregates import Union
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+def union_subquery(queryset, parent_field):
+    return models.Subquery(
+        queryset.filter(**{parent_field: models.OuterRef("pk")})
+        .order_by()
+        .values(parent_field)
+        .annotate(
+            union=models.Func(
+                Union("polygon"),
+                function="ST_Multi",
+                output_field=django.contrib.gis.db.models.fields.MultiPolygonField(
+                    srid=4326
+                ),
+            )
+        )
+        .values("union")
+    )
+
+
+def backfill_polygons(apps, schema_editor):
+    """
+    Fills the polygons of existing counties and districts from the union of
+    the polygons of their localities.
+    """
+    District = apps.get_model("django_postal_codes", "District")
+    County = apps.get_model("django_postal_codes", "County")
+    Locality = apps.get_model("django_postal_codes", "Locality")
+
+    County.objects.update(polygon=union_subquery(Locality.objects.all(), "county"))
+    District.objects.update(polygon=union_subquery(County.objects.all(), "district"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "django_postal_codes",
+            "0006_alter_postalcode_postal_code_postal_code_full_idx",
+        ),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="county",
+            name="polygon",
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(
+                blank=True,
+                null=True,
+                srid=4326,
+                verbose_name="Administrative region",
+            ),
+        ),
+        migrations.AddField(
+            model_name="district",
+            name="polygon",
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(
+                blank=True,
+                null=True,
+                srid=4326,
+                verbose_name="Administrative region",
+            ),
+        ),
+        migrations.RunPython(backfill_polygons, migrations.RunPython.noop),
+    ]
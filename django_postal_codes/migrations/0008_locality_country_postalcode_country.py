@@ -0,0 +1,60 @@
+# Generated by Django 4.2 on 2026-10-15 10:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_countries(apps, schema_editor):
+    """
+    Fills the denormalized country of existing localities and postal codes.
+    """
+    County = apps.get_model("django_postal_codes", "County")
+    Locality = apps.get_model("django_postal_codes", "Locality")
+    PostalCode = apps.get_model("django_postal_codes", "PostalCode")
+
+    Locality.objects.update(
+        country=models.Subquery(
+            County.objects.filter(pk=models.OuterRef("county")).values(
+                "district__country"
+            )
+        ),
+    )
+    PostalCode.objects.update(
+        country=models.Subquery(
+            Locality.objects.filter(pk=models.OuterRef("locality")).values("country")
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_postal_codes", "0007_county_polygon_district_polygon"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="locality",
+            name="country",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="localities",
+                to="django_postal_codes.country",
+                verbose_name="Country that the locality belongs to",
+            ),
+        ),
+        migrations.AddField(
+            model_name="postalcode",
+            name="country",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="postal_codes",
+                to="django_postal_codes.country",
+                verbose_name="Country that the postal code belongs to",
+            ),
+        ),
+        migrations.RunPython(fill_countries, migrations.RunPython.noop),
+    ]
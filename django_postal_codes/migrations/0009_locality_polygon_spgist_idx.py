@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-15 10:25
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("django_postal_codes", "0008_locality_country_postalcode_country"),
+    ]
+
+    operations = [
+        # Changing `spatial_index` doesn't touch the database, so the GiST index
+        # created along with the field is dropped explicitly
+        migrations.RunSQL(
+            "DROP INDEX IF EXISTS django_postal_codes_locality_polygon_id",
+            reverse_sql=(
+                "CREATE INDEX IF NOT EXISTS django_postal_codes_locality_polygon_id "
+                'ON django_postal_codes_locality USING GIST ("polygon")'
+            ),
+        ),
+        migrations.AlterField(
+            model_name="locality",
+            name="polygon",
+            field=django.contrib.gis.db.models.fields.MultiPolygonField(
+                blank=True,
+                null=True,
+                spatial_index=False,
+                srid=4326,
+                verbose_name="Administrative region",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="locality",
+            index=django.contrib.postgres.indexes.SpGistIndex(
+                fields=["polygon"],
+                fillfactor=100,
+                name="locality_polygon_spgist_idx",
+            ),
+        ),
+    ]
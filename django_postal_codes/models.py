@@ -1,32 +1,88 @@
 """
 Module containing the app models.
 """
-import json
-
-import shapely
 from django.contrib.gis.db import models
+from django.contrib.gis.db.models.aggregates import Union
+from django.contrib.postgres.indexes import GinIndex, OpClass, SpGistIndex
+from django.db.models import Func, OuterRef, Subquery
+from django.db.models.functions import Upper
 from django.utils.translation import gettext
 from django.utils.translation import gettext_lazy as _
-from shapely import wkt
-from shapely.geometry.multipolygon import MultiPolygon as ShapelyMultiPolygon
-from shapely.ops import unary_union
 
 
-def compute_polygon_union(polygons) -> dict:
+def format_full_address(
+    artery_components: list,
+    locality_name: str,
+    county_name: str,
+    district_name: str,
+    country_name: str,
+) -> str:
     """
-    Computes the union of django polygons, and returns
-    the result as a GeoJSON multipolygon dictionary
+    Formats the full address of a postal code from its artery components
+    and the names of the regions it belongs to.
     """
-    # Convert to shapely polygons
-    polygons = [wkt.loads(obj.wkt) for obj in polygons]
-    merged = unary_union(polygons)
+    full_name = " ".join(
+        component for component in artery_components if component is not None
+    )
+    # Check if locality and county are the same. If so dont include repeated name
+    suffix = f"{county_name}, {district_name}, {country_name}"
+    if locality_name != county_name:
+        suffix = f"{locality_name}, {suffix}"
+    if full_name:
+        return f"{full_name}, {suffix}"
+    return suffix
+
+
+def polygon_union_subquery(queryset, parent_field: str) -> Subquery:
+    """
+    Returns a subquery computing, with PostGIS, the union (as a MultiPolygon)
+    of the polygons of `queryset` that belong to the outer parent object.
+    """
+    return Subquery(
+        queryset.filter(**{parent_field: OuterRef("pk")})
+        .order_by()
+        .values(parent_field)
+        .annotate(
+            union=Func(
+                Union("polygon"),
+                function="ST_Multi",
+                output_field=models.MultiPolygonField(srid=4326),
+            )
+        )
+        .values("union")
+    )
 
-    # Make sure it is MultiPolygon
-    if merged.geom_type == "Polygon":
-        merged = ShapelyMultiPolygon([merged])
 
-    # Return as geojson dictionary
-    return json.loads(json.dumps(shapely.geometry.mapping(merged)))
+def update_region_polygons() -> None:
+    """
+    Stores the polygon of every `County` and `District`, computed from the
+    union of the polygons of their localities. Must be called whenever
+    localities are imported.
+    """
+    County.objects.update(
+        polygon=polygon_union_subquery(Locality.objects.all(), "county"),
+    )
+    # Districts are merged from the (already merged) counties
+    District.objects.update(
+        polygon=polygon_union_subquery(County.objects.all(), "district"),
+    )
+
+
+def update_denormalized_countries() -> None:
+    """
+    Fills the denormalized country of every `Locality` and `PostalCode`
+    that doesn't have one yet, from its county and locality respectively.
+    """
+    Locality.objects.filter(country__isnull=True).update(
+        country=Subquery(
+            County.objects.filter(pk=OuterRef("county")).values("district__country")
+        ),
+    )
+    PostalCode.objects.filter(country__isnull=True).update(
+        country=Subquery(
+            Locality.objects.filter(pk=OuterRef("locality")).values("country")
+        ),
+    )
 
 
 class BaseModel(models.Model):
@@ -55,6 +111,14 @@ class Country(BaseModel):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # Trigram index backing the `icontains` name filters, which
+            # compare `UPPER(name)` on PostgreSQL
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="country_name_trgm_idx",
+            ),
+        ]
 
 
 class District(BaseModel):
@@ -78,6 +142,15 @@ class District(BaseModel):
         related_name="districts",
     )
 
+    # Union of the polygons of all localities of the district, stored on import
+    polygon = models.MultiPolygonField(
+        verbose_name=_("Administrative region"),
+        null=True,
+        blank=True,
+        geography=False,
+        srid=4326,
+    )
+
     def __str__(self) -> str:
         """
         String representation of this model.
@@ -86,6 +159,21 @@ class District(BaseModel):
 
     class Meta:
         ordering = ["country", "name"]
+        constraints = [
+            # Natural key, used to upsert the data on imports
+            models.UniqueConstraint(
+                fields=["country", "name"],
+                name="unique_district_name_per_country",
+            ),
+        ]
+        indexes = [
+            # Trigram index backing the `icontains` name filters, which
+            # compare `UPPER(name)` on PostgreSQL
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="district_name_trgm_idx",
+            ),
+        ]
 
 
 class County(BaseModel):
@@ -111,6 +199,15 @@ class County(BaseModel):
         blank=False,
     )
 
+    # Union of the polygons of all localities of the county, stored on import
+    polygon = models.MultiPolygonField(
+        verbose_name=_("Administrative region"),
+        null=True,
+        blank=True,
+        geography=False,
+        srid=4326,
+    )
+
     def __str__(self) -> str:
         """
         String representation of this model.
@@ -119,6 +216,21 @@ class County(BaseModel):
 
     class Meta:
         ordering = ["district", "name"]
+        constraints = [
+            # Natural key, used to upsert the data on imports
+            models.UniqueConstraint(
+                fields=["district", "name"],
+                name="unique_county_name_per_district",
+            ),
+        ]
+        indexes = [
+            # Trigram index backing the `icontains` name filters, which
+            # compare `UPPER(name)` on PostgreSQL
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="county_name_trgm_idx",
+            ),
+        ]
 
 
 class Locality(BaseModel):
@@ -135,6 +247,17 @@ class Locality(BaseModel):
         blank=False,
         on_delete=models.CASCADE,
     )
+
+    # Denormalized country of the county, to filter without joins
+    country = models.ForeignKey(
+        Country,
+        verbose_name=_("Country that the locality belongs to"),
+        related_name="localities",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+    )
+
     name = models.CharField(
         max_length=255,
         verbose_name=_("Locality"),
@@ -142,12 +265,14 @@ class Locality(BaseModel):
         blank=False,
     )
 
+    # Indexed with SP-GiST instead of the default GiST index (see `Meta.indexes`)
     polygon = models.MultiPolygonField(
         verbose_name=_("Administrative region"),
         null=True,
         blank=True,
         geography=False,
         srid=4326,
+        spatial_index=False,
     )
 
     def save(self, *args, **kwargs):
@@ -157,6 +282,10 @@ class Locality(BaseModel):
         if self.polygon and isinstance(self.polygon, geos.Polygon):
             self.polygon = geos.MultiPolygon(self.polygon)
 
+        # Fill denormalized country
+        if self.country_id is None:
+            self.country_id = self.county.district.country_id
+
         super().save(*args, **kwargs)
 
     def __str__(self) -> str:
@@ -167,6 +296,29 @@ class Locality(BaseModel):
 
     class Meta:
         ordering = ["county", "name"]
+        constraints = [
+            # Natural key, used to upsert the data on imports
+            models.UniqueConstraint(
+                fields=["county", "name"],
+                name="unique_locality_name_per_county",
+            ),
+        ]
+        indexes = [
+            # Trigram index backing the `icontains` name filters, which
+            # compare `UPPER(name)` on PostgreSQL
+            GinIndex(
+                OpClass(Upper("name"), name="gin_trgm_ops"),
+                name="locality_name_trgm_idx",
+            ),
+            # SP-GiST index backing the point in polygon lookups, smaller and faster
+            # than GiST for these non-overlapping regions (requires PostGIS 2.5+).
+            # Polygons are only written on imports, so pages are filled completely
+            SpGistIndex(
+                fields=["polygon"],
+                fillfactor=100,
+                name="locality_polygon_spgist_idx",
+            ),
+        ]
 
 
 class PostalCode(BaseModel):
@@ -185,6 +337,16 @@ class PostalCode(BaseModel):
         on_delete=models.CASCADE,
     )
 
+    # Denormalized country of the locality, to filter without joins
+    country = models.ForeignKey(
+        Country,
+        verbose_name=_("Country that the postal code belongs to"),
+        related_name="postal_codes",
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+    )
+
     artery_type = models.CharField(
         max_length=255,
         blank=True,
@@ -227,7 +389,6 @@ class PostalCode(BaseModel):
         help_text="cp4",
         blank=True,
         null=False,
-        db_index=True,
     )
     postal_code_extension = models.IntegerField(
         verbose_name=_("Postal Code Extension"),
@@ -260,25 +421,20 @@ class PostalCode(BaseModel):
         Computes a full address based on the
         model fields.
         """
-        full_name = " ".join(
-            component
-            for component in [
+        return format_full_address(
+            [
                 self.artery_type,
                 self.prep1,
                 self.artery_title,
                 self.prep2,
                 self.artery_name,
                 self.artery_local,
-            ]
-            if component is not None
+            ],
+            self.locality.name,
+            self.locality.county.name,
+            self.locality.county.district.name,
+            self.locality.county.district.country.name,
         )
-        # Check if locality and county are the same. If so dont include repeated name
-        suffix = f"{self.locality.county.name}, {self.locality.county.district.name}, {self.locality.county.district.country.name}"
-        if self.locality.name != self.locality.county.name:
-            suffix = f"{self.locality.name}, {suffix}"
-        if full_name:
-            return f"{full_name}, {suffix}"
-        return suffix
 
     def save(
         self,
@@ -287,9 +443,20 @@ class PostalCode(BaseModel):
     ) -> None:
         # Fill full address
         self.full_address = self.get_full_address()
+        # Fill denormalized country
+        if self.country_id is None:
+            self.country_id = self.locality.county.district.country_id
         return super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = _("Postal Code")
         verbose_name_plural = _("Postal Codes")
         ordering = ["locality", "full_address"]
+        indexes = [
+            # Index for lookups by full postal code, which also serves lookups by
+            # postal code alone (its leading column)
+            models.Index(
+                fields=["postal_code", "postal_code_extension"],
+                name="postal_code_full_idx",
+            ),
+        ]